@@ -24,35 +24,66 @@ with st.expander("CSVファイルの取得方法", expanded=True):
     """)
 uploaded_file = st.file_uploader("CSVファイルをアップロード", type="csv")
 
-if uploaded_file is not None:
-    content = uploaded_file.read()
+# 集計に使うのはこの3列だけ。読み込む列を絞るとパースCPUもメモリも列数比で減る
+ANALYSIS_COLUMNS = ["約定日", "取引", "受渡金額/決済損益"]
+
+
+@st.cache_data(show_spinner="CSVを解析中...")
+def parse_sbi_csv(content: bytes, usecols=None):
+    """アップロードされたCSVのバイト列をDataFrameに変換する。
 
-    # エンコーディングを試行錯誤で特定し、行として読み込む
-    for enc in ["utf-8", "cp932", "shift_jis"]:
-        try:
-            lines = content.decode(enc).splitlines()
+    再実行（ウィジェット操作）のたびに200MB級のデコード・パースを
+    繰り返さないよう、ファイル内容をキーにキャッシュする。
+    """
+    # エンコーディングはバイト列のまま「約定日」を探して判別する
+    # （200MB級の全文デコードを最大3回繰り返さない。SBIのCSVは基本cp932）
+    for enc in ["cp932", "utf-8"]:
+        needle = "約定日".encode(enc)
+        pos = content.find(needle)
+        if pos != -1:
             break
-        except UnicodeDecodeError:
-            continue
     else:
-        st.error("⚠️ 文字コードが判別できませんでした。")
-        st.stop()
+        raise ValueError("'約定日' を含む行が見つかりませんでした。")
 
-    # ヘッダー行の特定
-    header_row_index = None
-    for i, line in enumerate(lines):
-        if "約定日" in line:
-            header_row_index = i
-            break
+    # ヘッダー行の特定（ヘッダーより前の改行数＝ヘッダーの行番号）
+    header_row_index = content.count(b"\n", 0, pos)
+
+    # ヘッダー行の先頭バイト位置から後ろをそのまま渡す。全文をデコードして
+    # 行リストをjoinし直す往復（200MB級の複製を伴う）をしない
+    offset = content.rfind(b"\n", 0, pos) + 1
 
-    if header_row_index is None:
-        st.error("⚠️ '約定日' を含む行が見つかりませんでした。")
+    # データ読み込み（pyarrowエンジンはマルチスレッドでパースする）
+    try:
+        df = pd.read_csv(io.BytesIO(content[offset:]), engine="pyarrow", encoding=enc, usecols=usecols)
+    except KeyError:
+        # usecols指定の列がCSVに無い（SBIの取引履歴ではないファイルなど）
+        raise ValueError(f"CSVに必要な列 {usecols} が見つかりませんでした。")
+    except UnicodeDecodeError:
+        raise ValueError("文字コードが判別できませんでした。")
+
+    # 取引は数種類の値しかないのでカテゴリ型（辞書エンコード）にしておく。
+    # 以降のフィルタが文字列走査ではなく整数コードの比較になる
+    if "取引" in df.columns:
+        df["取引"] = df["取引"].astype("category")
+
+    return df, header_row_index
+
+
+if uploaded_file is not None:
+    content = uploaded_file.getvalue()
+    try:
+        df, header_row_index = parse_sbi_csv(content, usecols=ANALYSIS_COLUMNS)
+    except ValueError as e:
+        st.error(f"⚠️ {e}")
         st.stop()
 
-    # データ読み込み
-    df = pd.read_csv(io.StringIO("\n".join(lines)), skiprows=header_row_index)
     st.success(f"✅ '約定日' を含む行 {header_row_index + 1} 行目から読み込みました。")
 
     show_summary(df)
     with st.expander("CSVデータ", expanded=False):
-        st.dataframe(df)
+        # 全列が必要なときだけ読み直す（結果はキャッシュされる）
+        if st.checkbox("全列を表示する"):
+            full_df, _ = parse_sbi_csv(content)
+            st.dataframe(full_df)
+        else:
+            st.dataframe(df)
@@ -1,104 +1,263 @@
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+import polars as pl
 import streamlit as st
 
-def color_profit_normalized(val, max_abs):
-    try:
-        val = float(val)
-    except:
-        return ''
-    
-    ratio = abs(val) / max_abs if max_abs != 0 else 0
-    alpha = min(0.4, ratio)
-
-    if val > 0:
-        return f'background-color: rgba(0, 180, 0, {alpha:.2f}); color: black;'
-    elif val < 0:
-        return f'background-color: rgba(200, 0, 0, {alpha:.2f}); color: black;'
-    else:
-        return ''
+# 透明度は小数2桁に丸めて出すので、取り得るCSSは0.00〜0.40の41通りしかない。
+# 先に全部作っておけば、セル毎のf-string整形が整数インデックスの表引きになる
+_GREEN_CSS = np.array(
+    [f'background-color: rgba(0, 180, 0, {a / 100:.2f}); color: black;' for a in range(41)],
+    dtype=object,
+)
+_RED_CSS = np.array(
+    [f'background-color: rgba(200, 0, 0, {a / 100:.2f}); color: black;' for a in range(41)],
+    dtype=object,
+)
 
-def show_summary(df: pd.DataFrame):
-    df = df[df["取引"].astype(str).str.contains("信用", na=False)]
-
-    # 整形
-    df["約定日"] = pd.to_datetime(df["約定日"], errors="coerce")
-    df["受渡金額/決済損益"] = pd.to_numeric(df["受渡金額/決済損益"], errors="coerce")
-    
-    # 有効な数値データのみを対象とする
-    df = df.dropna(subset=["受渡金額/決済損益"])
-
-    df["年月"] = df["約定日"].dt.to_period("M")
-    df["日付"] = df["約定日"].dt.date
-    df["勝ち"] = df["受渡金額/決済損益"] > 0
-    df["負け"] = df["受渡金額/決済損益"] < 0
-
-    df["勝ち損益のみ"] = df["受渡金額/決済損益"].where(df["勝ち"])
-    df["負け損益のみ"] = df["受渡金額/決済損益"].where(df["負け"])
-
-    # 集計
-    daily = df.groupby("日付").agg(
-        勝ち数=("勝ち", "sum"),
-        総取引数=("勝ち", "count"),
-        総損益=("受渡金額/決済損益", "sum"),
-        勝率=("勝ち", lambda x: 100.0 if len(x) == x.sum() else (x.sum() / len(x)) * 100),
-        最大利益=("勝ち損益のみ", "max"),
-        最大損失=("負け損益のみ", "min"),
-        平均利益=("勝ち損益のみ", "mean"),
-        平均損失=("負け損益のみ", "mean"),
-        平均損益=("受渡金額/決済損益", "mean")
-    ).reset_index().sort_values("日付", ascending=False)  # 日付の降順に並び替え
-
-    monthly = df.groupby("年月").agg(
-        勝ち数=("勝ち", "sum"),
-        総取引数=("勝ち", "count"),
-        総損益=("受渡金額/決済損益", "sum"),
-        勝率=("勝ち", lambda x: 100.0 if len(x) == x.sum() else (x.sum() / len(x)) * 100),
-        最大利益=("勝ち損益のみ", "max"),
-        最大損失=("負け損益のみ", "min"),
-        平均利益=("勝ち損益のみ", "mean"),
-        平均損失=("負け損益のみ", "mean"),
-        平均損益=("受渡金額/決済損益", "mean")
+def color_profit_normalized(col, max_abs):
+    """損益の列全体からCSSの配列を一括生成する（セル毎のPython呼び出しを避ける）。"""
+    values = col.to_numpy(dtype=float)
+    ratio = np.abs(values) / max_abs if max_abs else np.zeros(len(values))
+    alpha_idx = np.rint(np.minimum(0.4, ratio) * 100).astype(np.intp)
+
+    styles = np.full(len(values), '', dtype=object)
+    positive = values > 0
+    negative = values < 0
+    styles[positive] = _GREEN_CSS[alpha_idx[positive]]
+    styles[negative] = _RED_CSS[alpha_idx[negative]]
+    return styles
+
+@st.cache_data(show_spinner=False)
+def summarize_trades(df: pd.DataFrame):
+    """取引履歴から日毎・月毎の集計表と全体の成績合計を作る。
+
+    集計が一番重い処理なので、同じデータに対する再実行
+    （ウィジェット操作など）ではキャッシュ済みの結果を使い回す。
+    """
+    # 取引はカテゴリ型なので、「信用」の判定はカテゴリ一覧（数種類）に対してだけ
+    # 行い、行側は整数コードの照合（isin）で済ませる。
+    # 「信用」はただの文字列なのでregex=Falseで正規表現エンジンも通さない
+    trades = df["取引"].astype("category")  # パース側でカテゴリ化済みなら実質タダ
+    keep = trades.cat.categories[
+        trades.cat.categories.astype(str).str.contains("信用", regex=False, na=False)
+    ]
+    df = df.loc[trades.isin(keep)]
+
+    # 整形（NumPy配列で派生列を作り、フレームの構築は1回で済ませる。
+    # 列を1本ずつ挿入するとその度にコピー・断片化が起きる）
+    # 損益が数値にならない行（未決済の「--」等）を先に落とし、
+    # 日付のパースは残った行に対してだけ行う（変換より先にフィルタ）。
+    # downcastで値が収まるならfloat32にし、集計が触るバイト数を半分にする
+    # （円単位の損益はfloat32で十分。収まらない値があれば自動でfloat64のまま）
+    values = pd.to_numeric(df["受渡金額/決済損益"], errors="coerce", downcast="float").to_numpy()
+    has_value = ~np.isnan(values)
+    values = values[has_value]
+
+    # SBIのCSVの約定日はYYYY/MM/DD固定なので、formatを渡してC実装の
+    # 高速パスに乗せる（format無しだと1行ずつの推測パースに落ちることがある）。
+    # to_numpyのdtype指定は、0行のときに解像度がPolars非対応の秒になるのを防ぐ
+    dates = pd.to_datetime(
+        df["約定日"].to_numpy()[has_value], format="%Y/%m/%d", errors="coerce", cache=True
+    ).to_numpy("datetime64[ns]")
+
+    # 日付が読めない行も集計対象外
+    has_date = ~np.isnat(dates)
+    dates = dates[has_date]
+    values = values[has_date]
+    win = values > 0
+    loss = values < 0
+
+    # 集計（全行を走査するgroupbyは日毎の1回だけ）。
+    # Polarsの式エンジンは8個の集計を1パスに融合し、コア数に応じて並列実行する。
+    # 勝ち・負けはNaNでマスクした列ではなく0埋めの列にする。
+    # NaNをスキップする集計パスを通らずに済み、平均も合計÷件数で出せる
+    daily = (
+        pl.LazyFrame({
+            "日付": dates,
+            "受渡金額/決済損益": values,
+            "勝ち": win,
+            "負け": loss,
+            "勝ち額": np.where(win, values, 0.0),
+            "負け額": np.where(loss, values, 0.0),
+        })
+        .group_by("日付")
+        .agg(
+            勝ち数=pl.col("勝ち").sum(),
+            負け数=pl.col("負け").sum(),
+            総取引数=pl.len(),
+            総損益=pl.col("受渡金額/決済損益").sum(),
+            最大利益=pl.col("勝ち額").max(),
+            最大損失=pl.col("負け額").min(),
+            勝ち合計=pl.col("勝ち額").sum(),
+            負け合計=pl.col("負け額").sum(),
+        )
+        .sort("日付", descending=True)  # 日付の降順に並び替え
+        .collect()
+        .to_pandas()
+    )
+    # 日付はdatetime64のまま持ち回る。.dt.dateで1行ずつPyObjectの
+    # datetime.dateに箱詰めせず、表示時にフォーマットだけ日付のみにする
+
+    # 月毎の値は日毎の集計から導出できる（合計・件数・最大/最小は結合可能）。
+    # キーはPeriod（1行ずつPyObject）ではなくdatetime64[M]への切り捨てで作り、
+    # groupbyをint64ハッシュの高速パスに乗せる
+    monthly = daily.groupby(
+        pd.Series(daily["日付"].to_numpy().astype("datetime64[M]"), name="年月")
+    ).agg(
+        勝ち数=("勝ち数", "sum"),
+        負け数=("負け数", "sum"),
+        総取引数=("総取引数", "sum"),
+        総損益=("総損益", "sum"),
+        最大利益=("最大利益", "max"),
+        最大損失=("最大損失", "min"),
+        勝ち合計=("勝ち合計", "sum"),
+        負け合計=("負け合計", "sum")
     ).reset_index().sort_values("年月", ascending=False)  # 年月の降順に並び替え
+    # 表示は従来どおり「YYYY-MM」にする（月数行だけの変換なのでコストは無視できる）
+    monthly["年月"] = monthly["年月"].dt.to_period("M")
+
+    # 全体の成績指標用の合計（作業用の列を落とす前に取っておく）
+    totals = {
+        "総利益": daily["勝ち合計"].sum(),
+        "総損失": daily["負け合計"].sum(),
+        "勝ち数": daily["勝ち数"].sum(),
+        "負け数": daily["負け数"].sum(),
+    }
+
+    # 勝率・平均はグループ後に合計と件数から一括計算（グループ毎のPython関数呼び出しを避ける）
+    columns = ["勝ち数", "総取引数", "総損益", "勝率", "最大利益", "最大損失", "平均利益", "平均損失", "平均損益"]
+    for table in (daily, monthly):
+        table["勝率"] = table["勝ち数"] * 100.0 / table["総取引数"]
+        table["平均利益"] = table["勝ち合計"] / table["勝ち数"]
+        table["平均損失"] = table["負け合計"] / table["負け数"]
+        table["平均損益"] = table["総損益"] / table["総取引数"]
+        # 勝ち（負け）が無いグループは0埋めの影響を受けるので空欄（NaN)に戻す
+        table.loc[table["勝ち数"] == 0, "最大利益"] = np.nan
+        table.loc[table["負け数"] == 0, "最大損失"] = np.nan
+
+    # 表示順を元に戻す（作業用の列は落とす）
+    daily = daily[["日付"] + columns]
+    monthly = monthly[["年月"] + columns]
+
+    return daily, monthly, totals
+
+
+# スタイルを付けて表示する最大行数。StylerのHTML生成コストは行数に比例するが、
+# 画面に見えるのは高々数十行なので、先頭だけ装飾して残りは無装飾で出す
+STYLED_ROWS = 200
 
-    # 最大絶対値の取得（色付け用）
+# 表の数値フォーマット（日毎・月毎で共通。表に無い列は適用時に落とす）
+TABLE_FORMATS = {
+    "日付": lambda d: str(d)[:10],
+    "総損益": "{:,.0f} 円",
+    "勝率": "{:.1f} %",
+    "最大利益": "{:,.0f} 円",
+    "最大損失": "{:,.0f} 円",
+    "平均利益": "{:,.0f} 円",
+    "平均損失": "{:,.0f} 円",
+    "平均損益": "{:,.0f} 円",
+}
+
+
+@st.cache_data(show_spinner=False)
+def styled_table_html(table: pd.DataFrame, max_abs) -> str:
+    """スタイル適用済みの表を静的HTMLにして返す。
+
+    Stylerの適用とHTML化はサイズに比例して重いので、内容が変わらない間は
+    キャッシュしたHTMLを使い回す（無関係なウィジェット操作による再実行で
+    スタイル計算をやり直さない）。
+    """
+    styler = table.style\
+        .format({k: v for k, v in TABLE_FORMATS.items() if k in table.columns})\
+        .apply(color_profit_normalized, max_abs=max_abs, subset=["総損益"])\
+        .hide(axis="index")
+    return f'<div style="max-height: 480px; overflow: auto;">{styler.to_html()}</div>'
+
+
+@st.cache_data(show_spinner=False)
+def build_daily_chart(daily: pd.DataFrame) -> go.Figure:
+    """日毎の損益と累積損益の2段グラフを組み立てる。
+
+    dictリテラル＋skip_invalid=Trueで属性毎のPythonレベル検証
+    （add_trace/update_layoutのたびに走る）を飛ばし、同じ集計結果の
+    再実行ではキャッシュ済みのFigureを使い回す。
+    """
+    # 累積損益の計算（Series・列挿入を介さず、ndarrayへの1パスで済ませる）
+    cumulative = np.cumsum(daily["総損益"].to_numpy())
+    x = daily["日付"].to_numpy()
+
+    return go.Figure({
+        "data": [
+            {  # --- 上段：累積損益（折れ線グラフ） ---
+                "type": "scatter",
+                "x": x,
+                "y": cumulative,
+                "mode": "lines+markers",
+                "name": "累積損益",
+                "line": {"color": "royalblue", "width": 2},
+                "yaxis": "y1",
+            },
+            {  # --- 下段：日毎の損益（棒グラフ） ---
+                "type": "bar",
+                "x": x,
+                "y": daily["総損益"].to_numpy(),
+                "name": "日毎の損益",
+                "marker": {"color": "lightblue"},
+                "yaxis": "y2",
+            },
+        ],
+        # レイアウト調整（上下に2段で表示）
+        "layout": {
+            "height": 600,
+            "xaxis": {"domain": [0, 1], "title": "日付"},
+            "yaxis": {
+                "title": "累積損益（円）",
+                "domain": [0.4, 1],  # 上段40%〜100%
+                "tickformat": ",",
+                "zeroline": True,
+                "zerolinewidth": 2,
+                "zerolinecolor": "gray",
+            },
+            "yaxis2": {
+                "title": "日毎の損益（円）",
+                "domain": [0, 0.3],  # 下段0%〜30%
+                "tickformat": ",",
+                "zeroline": True,
+                "zerolinewidth": 2,
+                "zerolinecolor": "gray",
+            },
+            "legend": {"orientation": "h", "y": 1.05, "x": 0},
+            "margin": {"t": 50, "b": 50},
+        },
+    }, skip_invalid=True)
+
+
+def show_summary(df: pd.DataFrame):
+    daily, monthly, totals = summarize_trades(df)
+
+    # 最大絶対値の取得（色付け用。色の正規化は全期間に対して行う）
     max_daily_abs = daily["総損益"].abs().max()
     max_monthly_abs = monthly["総損益"].abs().max()
 
-    # 表示（スタイル適用）
+    # 表示（スタイル適用済みのHTMLをキャッシュから流す）
     st.subheader("📅 日毎のトレード成績")
-    styled_daily = daily.style\
-        .format({
-            "総損益": "{:,.0f} 円",
-            "勝率": "{:.1f} %",
-            "最大利益": "{:,.0f} 円",  # 追加
-            "最大損失": "{:,.0f} 円",
-            "平均利益": "{:,.0f} 円",
-            "平均損失": "{:,.0f} 円",
-            "平均損益": "{:,.0f} 円"
-        })\
-        .applymap(lambda v: color_profit_normalized(v, max_daily_abs), subset=["総損益"])
-    st.dataframe(styled_daily)
+    st.markdown(styled_table_html(daily.head(STYLED_ROWS), max_daily_abs), unsafe_allow_html=True)
+    if len(daily) > STYLED_ROWS:
+        with st.expander(f"全期間（{len(daily)}日）を表示", expanded=False):
+            st.dataframe(daily)
 
     st.subheader("🗓️ 月毎のトレード成績")
-    styled_monthly = monthly.style\
-        .format({
-            "総損益": "{:,.0f} 円",
-            "勝率": "{:.1f} %",
-            "最大利益": "{:,.0f} 円",  # 追加
-            "最大損失": "{:,.0f} 円",
-            "平均利益": "{:,.0f} 円",
-            "平均損失": "{:,.0f} 円",
-            "平均損益": "{:,.0f} 円"
-        })\
-        .applymap(lambda v: color_profit_normalized(v, max_monthly_abs), subset=["総損益"])
-    st.dataframe(styled_monthly)
-
-    # 成績指標
-    avg_profit = df.loc[df["勝ち"], "受渡金額/決済損益"].mean()
-    avg_loss = df.loc[df["負け"], "受渡金額/決済損益"].mean()
-    total_profit = df.loc[df["勝ち"], "受渡金額/決済損益"].sum()
-    total_loss = df.loc[df["負け"], "受渡金額/決済損益"].sum()
+    st.markdown(styled_table_html(monthly.head(STYLED_ROWS), max_monthly_abs), unsafe_allow_html=True)
+    if len(monthly) > STYLED_ROWS:
+        with st.expander(f"全期間（{len(monthly)}ヶ月）を表示", expanded=False):
+            st.dataframe(monthly)
+
+    # 成績指標（集計済みの合計と件数から求める）
+    avg_profit = totals["総利益"] / totals["勝ち数"] if totals["勝ち数"] else float("nan")
+    avg_loss = totals["総損失"] / totals["負け数"] if totals["負け数"] else float("nan")
+    total_profit = totals["総利益"]
+    total_loss = totals["総損失"]
 
     payoff_ratio = avg_profit / abs(avg_loss) if avg_loss else None
     profit_factor = total_profit / abs(total_loss) if total_loss else None
@@ -114,56 +273,4 @@ def show_summary(df: pd.DataFrame):
 
     # グラフ
     st.subheader("📈 日毎の総損益と累積損益")
-    daily["累積損益"] = daily["総損益"].cumsum()
-
-    # 累積損益の計算
-    daily["累積損益"] = daily["総損益"].cumsum()
-
-    # グラフ作成
-    fig = go.Figure()
-
-    # --- 上段：累積損益（折れ線グラフ） ---
-    fig.add_trace(go.Scatter(
-        x=daily["日付"],
-        y=daily["累積損益"],
-        mode="lines+markers",
-        name="累積損益",
-        line=dict(color="royalblue", width=2),
-        yaxis="y1"
-    ))
-
-    # --- 下段：日毎の損益（棒グラフ） ---
-    fig.add_trace(go.Bar(
-        x=daily["日付"],
-        y=daily["総損益"],
-        name="日毎の損益",
-        marker_color="lightblue",
-        yaxis="y2"
-    ))
-
-    # レイアウト調整（上下に2段で表示）
-    fig.update_layout(
-        height=600,
-        xaxis=dict(domain=[0, 1], title="日付"),
-        yaxis=dict(
-            title="累積損益（円）",
-            domain=[0.4, 1],  # 上段40%〜100%
-            tickformat=",",
-            zeroline=True,
-            zerolinewidth=2,
-            zerolinecolor="gray"
-        ),
-        yaxis2=dict(
-            title="日毎の損益（円）",
-            domain=[0, 0.3],  # 下段0%〜30%
-            tickformat=",",
-            zeroline=True,
-            zerolinewidth=2,
-            zerolinecolor="gray"
-        ),
-        legend=dict(orientation="h", y=1.05, x=0),
-        margin=dict(t=50, b=50)
-    )
-
-
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(build_daily_chart(daily), use_container_width=True)